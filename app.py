@@ -1,22 +1,62 @@
 import json
+from concurrent.futures import ThreadPoolExecutor
 from typing import List
 
+import pandas as pd
+import psycopg2
+import requests
 import streamlit as st
 from dotenv import load_dotenv
 
-from vector_store import VectorStore, flatten_schema_json
+from vector_store import EMBEDDING_MODEL_NAME, VectorStore, flatten_schema_json, get_pool, load_embedding_model
 from schema_utils import fetch_schema_from_postgres
 from db import SQLDatabase
 from llm import LLM
 
 
+# Runs after the imports above, so modules read their env settings when used rather than at import
 load_dotenv()
 st.set_page_config(page_title="Text2SQL", layout="wide")
 
+# Most (question, top_k, schema) entries of generated SQL kept per session
+GENERATED_SQL_LIMIT = 32
+
 
 @st.cache_resource
 def get_services():
-    return VectorStore(), SQLDatabase(), LLM()
+    llm = LLM()
+    # Overlap the slow cold-start steps: model load, DB connectivity check, LLM provider ping
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        model_future = executor.submit(load_embedding_model, EMBEDDING_MODEL_NAME)
+        warmups = [executor.submit(_warm_vector_pool)]
+        if llm.provider == "ollama":
+            warmups.append(executor.submit(requests.get, f"{llm.base_url}/api/tags", timeout=2))
+        model = model_future.result()
+        for future in warmups:
+            try:
+                future.result()
+            except Exception:
+                # Pre-warm only; real errors surface on first use
+                pass
+    return VectorStore(model=model), SQLDatabase(), llm
+
+
+def _warm_vector_pool() -> None:
+    # Opens a pooled connection the store will reuse, rather than a throwaway one
+    with get_pool().connection():
+        pass
+
+
+@st.cache_data(ttl=600, show_spinner=False)
+def search_schema(_vs: VectorStore, question: str, top_k: int, schema_fingerprint: str) -> List[dict]:
+    """Schema search, cached per (question, top_k, indexed schema); failures raise and are not cached."""
+    return _vs.search(question, k=top_k)
+
+
+@st.cache_data(ttl=600, show_spinner=False)
+def run_sql(_db: SQLDatabase, sql: str) -> pd.DataFrame:
+    """Query results, cached per SQL text; failures raise and are not cached."""
+    return _db.run_query(sql)
 
 
 def sidebar_ingest_ui(vs: VectorStore) -> None:
@@ -29,16 +69,14 @@ def sidebar_ingest_ui(vs: VectorStore) -> None:
     if uploaded:
         schema = json.load(uploaded)
         rows = flatten_schema_json(schema)
-        vs.setup()
         n = vs.upsert_chunks(rows)
-        st.sidebar.success(f"Indexed {n} chunks from schema.")
+        st.sidebar.success(f"Indexed {n} new chunks from schema.")
     st.sidebar.markdown("---")
     if st.sidebar.button("Fetch current DB schema (public)"):
         schema = fetch_schema_from_postgres()
         rows = flatten_schema_json(schema)
-        vs.setup()
         n = vs.upsert_chunks(rows)
-        st.sidebar.success(f"Indexed {n} chunks from live DB schema.")
+        st.sidebar.success(f"Indexed {n} new chunks from live DB schema.")
 
 
 def main_query_ui(vs: VectorStore, db: SQLDatabase, llm: LLM) -> None:
@@ -48,22 +86,49 @@ def main_query_ui(vs: VectorStore, db: SQLDatabase, llm: LLM) -> None:
     run = st.button("Generate & Run", type="primary")
 
     if run and question:
-        vs.setup()
-        hits = vs.search(question, k=top_k)
+        try:
+            fingerprint = vs.fingerprint()
+            hits = search_schema(vs, question, top_k, fingerprint)
+        except psycopg2.Error as e:
+            st.error(f"Database error: {e}")
+            return
         context_lines: List[str] = [h["chunk"] for h in hits]
         with st.expander("Schema context"):
             for h in hits:
                 st.write(f"[{h['score']:.2f}] {h['chunk']}")
 
-        sql = llm.generate_sql(question, context_lines)
-        st.code(sql, language="sql")
-
-        if not sql.strip().lower().startswith("select"):
-            st.warning("Generated SQL is not a SELECT. Skipping execution for safety.")
+        # Generated SQL is kept per session, keyed like the search, so repeat clicks skip the LLM
+        generated = st.session_state.setdefault("generated_sql", {})
+        key = (question, top_k, fingerprint)
+        if key in generated:
+            sql = generated[key]
+            st.code(sql, language="sql")
+        else:
+            # Show tokens as they arrive, then swap in the cleaned-up SQL
+            sql_placeholder = st.empty()
+            try:
+                with sql_placeholder.container():
+                    raw = st.write_stream(llm.stream_sql(question, context_lines))
+            except (requests.RequestException, RuntimeError) as e:
+                sql_placeholder.error(f"SQL generation failed: {e}")
+                return
+            sql = llm.postprocess_sql(raw)
+            if not sql.strip():
+                # Not stored, so the next click asks the model again
+                sql_placeholder.warning("The model returned no SQL. Try again or rephrase the question.")
+                return
+            generated[key] = sql
+            while len(generated) > GENERATED_SQL_LIMIT:
+                # Dicts keep insertion order, so this drops the oldest entry
+                del generated[next(iter(generated))]
+            sql_placeholder.code(sql, language="sql")
+
+        if not sql.strip().lower().startswith(("select", "with")):
+            st.warning("Generated SQL is not a query. Skipping execution for safety.")
             return
 
         try:
-            df = db.run_query(sql)
+            df = run_sql(db, sql)
         except Exception as e:
             st.error(f"SQL execution failed: {e}")
             return
@@ -1,27 +1,188 @@
+import json
+import threading
+from contextlib import contextmanager
 from typing import Any, List, Tuple
 
-import psycopg2
 import pandas as pd
+import psycopg2
+import pyarrow as pa
+from psycopg2.pool import ThreadedConnectionPool
 
 from config import DB_STANDARD
 
 
+POOL_SIZE = 8
+# Seconds; an unreachable host fails fast instead of hanging until the OS TCP timeout
+CONNECT_TIMEOUT = 5
+READ_CHUNK_ROWS = 10_000
+# json, jsonb and their array type oids
+JSON_TYPE_OIDS = {114, 3802, 199, 3807}
+
+# Session defaults: read-only and time-boxed. A statement can still SET these, so run_query also pins each
+# transaction read-only and allows one statement only, and the pool discards session state on return.
+# Only a role limited to SELECT truly enforces read-only access.
+SESSION_OPTIONS = (
+    "-c default_transaction_read_only=on "
+    "-c statement_timeout=10000 "
+    "-c idle_in_transaction_session_timeout=5000"
+)
+
+
+class BlockingConnectionPool(ThreadedConnectionPool):
+    """ThreadedConnectionPool that connects lazily, keeps returned connections idle and blocks when exhausted.
+
+    Connections are opened on demand up to maxconn, so creating the pool costs nothing. getconn()
+    waits for a free slot instead of raising PoolError once maxconn are borrowed.
+    """
+
+    def __init__(self, maxconn: int, *args, **kwargs) -> None:
+        self._slots = threading.BoundedSemaphore(maxconn)
+        super().__init__(0, maxconn, *args, **kwargs)
+        # putconn() closes returned connections once minconn are idle; raising it after the (empty)
+        # initial fill keeps every opened connection for reuse
+        self.minconn = maxconn
+
+    def getconn(self, key=None):
+        self._slots.acquire()
+        try:
+            return super().getconn(key)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def putconn(self, conn=None, key=None, close=False):
+        try:
+            super().putconn(conn, key, close)
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection; commits on success, rolls back on error."""
+        conn = self.getconn()
+        try:
+            with conn:
+                yield conn
+        finally:
+            self.putconn(conn)
+
+
+# One pool per pool class and set of connection params, shared across the process
+_POOLS: dict[tuple, BlockingConnectionPool] = {}
+_POOLS_LOCK = threading.Lock()
+
+
+def get_pool(conn_params: dict, pool_cls: type = BlockingConnectionPool, **kwargs) -> BlockingConnectionPool:
+    """Return (creating on first use) the shared pool for these params; extra kwargs go to connect()."""
+    key = (pool_cls, tuple(sorted(conn_params.items())), tuple(sorted(kwargs.items())))
+    with _POOLS_LOCK:
+        if key not in _POOLS:
+            _POOLS[key] = pool_cls(
+                POOL_SIZE,
+                host=conn_params["host"],
+                port=conn_params["port"],
+                dbname=conn_params["dbname"],
+                user=conn_params["user"],
+                password=conn_params["password"],
+                **{"connect_timeout": CONNECT_TIMEOUT, **kwargs},
+            )
+        return _POOLS[key]
+
+
+class _ReadOnlyConnectionPool(BlockingConnectionPool):
+    """Pool for generated SQL; resets session state so a SET cannot carry over to the next borrower."""
+
+    def putconn(self, conn=None, key=None, close=False):
+        if not close and not conn.closed:
+            try:
+                conn.rollback()
+                # DISCARD ALL cannot run inside a transaction block
+                conn.autocommit = True
+                with conn.cursor() as cur:
+                    cur.execute("DISCARD ALL;")
+                conn.autocommit = False
+            except psycopg2.Error:
+                close = True
+        super().putconn(conn, key, close)
+
+
 class SQLDatabase:
     def __init__(self, conn_params: dict | None = None) -> None:
         self.conn_params = conn_params or DB_STANDARD
 
     def _connect(self):
-        return psycopg2.connect(
-            host=self.conn_params["host"],
-            port=self.conn_params["port"],
-            dbname=self.conn_params["dbname"],
-            user=self.conn_params["user"],
-            password=self.conn_params["password"],
-        )
+        return get_pool(self.conn_params, _ReadOnlyConnectionPool, options=SESSION_OPTIONS).connection()
 
     def run_query(self, sql: str) -> pd.DataFrame:
-        with self._connect() as conn:
-            df = pd.read_sql_query(sql, conn)
+        statement = self._single_statement(sql)
+        # A named (server-side) cursor streams rows in READ_CHUNK_ROWS batches; each batch becomes an
+        # Arrow RecordBatch right away, so only one batch of Python row objects is alive at a time.
+        with self._connect() as conn, conn.cursor(name="text2sql_result") as cur:
+            with conn.cursor() as guard:
+                # Unlike the session default, this cannot be switched off later in the transaction
+                guard.execute("SET TRANSACTION READ ONLY;")
+            cur.itersize = READ_CHUNK_ROWS
+            cur.execute(statement)
+            rows = cur.fetchmany(READ_CHUNK_ROWS)
+            names = [d.name for d in cur.description]
+            json_cols = {i for i, d in enumerate(cur.description) if d.type_code in JSON_TYPE_OIDS}
+            batches: List[pa.RecordBatch] = []
+            while rows:
+                arrays = [self._to_arrow(list(values), i in json_cols) for i, values in enumerate(zip(*rows))]
+                batches.append(pa.RecordBatch.from_arrays(arrays, names=names))
+                rows = cur.fetchmany(READ_CHUNK_ROWS)
+        # Convert under positional names: joins often repeat column names, which pyarrow's pandas
+        # metadata cannot map back to the right dtypes
+        table = self._unify(batches, names).rename_columns([str(i) for i in range(len(names))])
+        df = table.to_pandas(types_mapper=pd.ArrowDtype)
+        df.columns = names
         return df
 
+    @staticmethod
+    def _single_statement(sql: str) -> str:
+        statement = sql.strip()
+        while statement.endswith(";"):
+            statement = statement[:-1].rstrip()
+        # psycopg2 pastes the text into DECLARE ... CURSOR FOR and sends it as a simple query, which runs
+        # every statement in it. Any ";" left is refused, even one inside a string literal.
+        if ";" in statement:
+            raise ValueError("Only a single SQL statement can be run.")
+        return statement
+
+    @classmethod
+    def _unify(cls, batches: List[pa.RecordBatch], names: List[str]) -> pa.Table:
+        """Combine per-batch RecordBatches whose inferred column types may differ into one Table."""
+        if not batches:
+            return pa.Table.from_arrays([pa.array([]) for _ in names], names=names)
+        columns: List[List[pa.Array]] = []
+        for i in range(len(names)):
+            chunks = [b.column(i) for b in batches]
+            try:
+                # Widens null/int/decimal differences between batches; anything else falls back to text
+                target = pa.unify_schemas(
+                    [pa.schema([("c", c.type)]) for c in chunks], promote_options="permissive"
+                ).field("c").type
+                columns.append([cls._cast(c, target) for c in chunks])
+            except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+                columns.append([cls._cast(c, pa.string()) for c in chunks])
+        unified = [pa.RecordBatch.from_arrays([col[j] for col in columns], names=names) for j in range(len(batches))]
+        return pa.Table.from_batches(unified)
+
+    @staticmethod
+    def _cast(chunk: pa.Array, target: pa.DataType) -> pa.Array:
+        if chunk.type == target:
+            return chunk
+        if target == pa.string():
+            return pa.array([None if v is None else str(v) for v in chunk.to_pylist()], type=pa.string())
+        return chunk.cast(target)
 
+    @staticmethod
+    def _to_arrow(values: List[Any], as_json: bool = False) -> pa.Array:
+        if as_json:
+            # Inferring from the parsed documents would turn them into structs with keys merged across rows
+            return pa.array([None if v is None else json.dumps(v) for v in values], type=pa.string())
+        try:
+            return pa.array(values)
+        except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+            # Types Arrow cannot infer (uuid, ranges, ...) are shown as text
+            return pa.array([None if v is None else str(v) for v in values], type=pa.string())
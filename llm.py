@@ -1,24 +1,47 @@
-from typing import List
+from typing import Iterator, List
+import asyncio
+import aiohttp
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import os
 import logging
 import json
+import re
 from pathlib import Path
 
 
+SYSTEM_PROMPT = (
+    "You are a helpful assistant that writes syntactically correct PostgreSQL SQL based on the provided database schema.\n"
+    "- Use only tables, columns, and relations that appear in the context.\n"
+    "- Prefer simple SELECTs. If ambiguous, make reasonable assumptions.\n"
+    "- Return ONLY the SQL query. Do not include explanations or markdown fences."
+)
+OLLAMA_NUM_CTX = 4096
+_FENCE_RE = re.compile(r"```(?:sql\b)?", re.IGNORECASE)
+
+
 class LLM:
     """LLM client supporting multiple providers (ollama, groq, hf). Default: ollama.
 
     Providers:
-      - ollama (local): OLLAMA_MODEL, OLLAMA_BASE_URL
+      - ollama (local): OLLAMA_MODEL, OLLAMA_BASE_URL, OLLAMA_KEEP_ALIVE
       - groq (hosted, free tier): GROQ_API_KEY, GROQ_MODEL, GROQ_BASE_URL
       - hf (Hugging Face Inference API): HF_API_KEY, HF_MODEL
+
+    ``agenerate_sql`` issues several generations concurrently. For Ollama, set
+    OLLAMA_NUM_PARALLEL to the same value the server runs with (``OLLAMA_NUM_PARALLEL=4 ollama serve``).
     """
 
     def __init__(self, model: str | None = None, base_url: str | None = None) -> None:
         self.provider = os.getenv("LLM_PROVIDER", "ollama").lower()
         self.model = model or os.getenv("OLLAMA_MODEL", "sqlcoder")
         self.base_url = base_url or os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
+        try:
+            self.ollama_num_parallel = int(os.getenv("OLLAMA_NUM_PARALLEL", "4"))
+        except ValueError:
+            self.ollama_num_parallel = 4
+        self.ollama_keep_alive = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
 
         # Groq config
         self.groq_api_key = os.getenv("GROQ_API_KEY")
@@ -37,20 +60,125 @@ class LLM:
         except ValueError:
             self.log_max_chars = 2000
         self._setup_logger()
+        self.session = self._build_session()
+
+    def _build_session(self) -> requests.Session:
+        """One keep-alive session per client so repeated calls skip the TCP/TLS handshake."""
+        session = requests.Session()
+        # Retry only failed connects and the listed statuses. A read timeout means the server is
+        # already generating; retrying it would multiply the UI wait and re-bill tokens on Groq/HF.
+        retries = Retry(
+            total=2,
+            connect=2,
+            read=0,
+            status=2,
+            backoff_factor=0.3,
+            status_forcelist=[429, 502, 503, 504],
+            allowed_methods=None,  # POST is safe to resend in those cases
+        )
+        adapter = HTTPAdapter(pool_connections=8, pool_maxsize=8, max_retries=retries)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        session.headers["Connection"] = "keep-alive"
+        if self.provider == "groq" and self.groq_api_key:
+            session.headers["Authorization"] = f"Bearer {self.groq_api_key}"
+        elif self.provider == "hf" and self.hf_api_key:
+            session.headers["Authorization"] = f"Bearer {self.hf_api_key}"
+        return session
 
     def generate_sql(self, question: str, schema_context: List[str]) -> str:
-        prompt = self._build_prompt(question, schema_context)
+        prompt = self._build_user(question, schema_context)
         if self.provider == "groq":
             return self._generate_sql_groq(prompt)
         if self.provider == "hf":
             return self._generate_sql_hf(prompt)
         return self._generate_sql_ollama(prompt)
 
+    def stream_sql(self, question: str, schema_context: List[str]) -> Iterator[str]:
+        """Yield raw model output as it is generated; pass the joined text to postprocess_sql.
+
+        Only Ollama streams token by token; other providers yield the whole answer at once.
+        """
+        prompt = self._build_user(question, schema_context)
+        if self.provider in {"groq", "hf"}:
+            yield self.generate_sql(question, schema_context)
+            return
+        self._log_event("request", {"provider": "ollama", "model": self.model, "prompt": prompt})
+        parts: List[str] = []
+        with self.session.post(
+            f"{self.base_url}/api/generate",
+            json={**self._ollama_payload(prompt), "stream": True},
+            timeout=120,
+            stream=True,
+        ) as resp:
+            resp.raise_for_status()
+            for line in resp.iter_lines():
+                if not line:
+                    continue
+                chunk = json.loads(line)
+                if chunk.get("error"):
+                    # Mid-stream failures arrive as an error line on an HTTP 200 response
+                    self._log_event("error", {"provider": "ollama", "model": self.model, "error": chunk["error"]})
+                    raise RuntimeError(f"Ollama error: {chunk['error']}")
+                token = chunk.get("response", "")
+                if token:
+                    parts.append(token)
+                    yield token
+                if chunk.get("done"):
+                    break
+        self._log_event("response", {"provider": "ollama", "model": self.model, "response": "".join(parts)})
+
+    def postprocess_sql(self, text: str) -> str:
+        """Clean up raw model output, e.g. the text collected from stream_sql."""
+        return self._postprocess_sql(text)
+
+    async def agenerate_sql(self, questions: List[str], schema_context: List[str]) -> List[str]:
+        """Generate SQL for several questions concurrently, sharing one schema context."""
+        # Ollama only runs OLLAMA_NUM_PARALLEL requests at once; more connections would just queue
+        limit = self.ollama_num_parallel if self.provider not in {"groq", "hf"} else 16
+        headers = {}
+        if "Authorization" in self.session.headers:
+            headers["Authorization"] = self.session.headers["Authorization"]
+        async with aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=limit),
+            headers=headers,
+            timeout=aiohttp.ClientTimeout(total=180),
+        ) as session:
+            tasks = [self._agenerate_one(session, self._build_user(q, schema_context)) for q in questions]
+            return list(await asyncio.gather(*tasks))
+
+    def generate_sql_many(self, questions: List[str], schema_context: List[str]) -> List[str]:
+        """Blocking wrapper around agenerate_sql for callers without an event loop (e.g. Streamlit)."""
+        return asyncio.run(self.agenerate_sql(questions, schema_context))
+
+    async def _agenerate_one(self, session: aiohttp.ClientSession, prompt: str) -> str:
+        if self.provider == "groq":
+            provider, model = "groq", self.groq_model
+            url, payload = f"{self.groq_base}/chat/completions", self._groq_payload(prompt)
+        elif self.provider == "hf":
+            provider, model = "hf", self.hf_model
+            url, payload = f"https://api-inference.huggingface.co/models/{self.hf_model}", self._hf_payload(prompt)
+        else:
+            provider, model = "ollama", self.model
+            url, payload = f"{self.base_url}/api/generate", self._ollama_payload(prompt)
+        self._log_event("request", {"provider": provider, "model": model, "prompt": prompt})
+        async with session.post(url, json=payload) as resp:
+            resp.raise_for_status()
+            data = await resp.json()
+        if provider == "groq":
+            text = data.get("choices", [{}])[0].get("message", {}).get("content", "")
+        elif provider == "hf":
+            text = self._hf_text(data)
+        else:
+            text = data.get("response", "")
+        self._log_event("response", {"provider": provider, "model": model, "response": text})
+        return self._postprocess_sql(text)
+
     def _generate_sql_ollama(self, prompt: str) -> str:
         self._log_event("request", {"provider": "ollama", "model": self.model, "prompt": prompt})
-        resp = requests.post(
+        resp = self.session.post(
             f"{self.base_url}/api/generate",
-            json={"model": self.model, "prompt": prompt, "stream": False},
+            json=self._ollama_payload(prompt),
             timeout=120,
         )
         resp.raise_for_status()
@@ -61,17 +189,7 @@ class LLM:
 
     def _generate_sql_groq(self, prompt: str) -> str:
         self._log_event("request", {"provider": "groq", "model": self.groq_model, "prompt": prompt})
-        headers = {"Authorization": f"Bearer {self.groq_api_key}", "Content-Type": "application/json"}
-        payload = {
-            "model": self.groq_model,
-            "messages": [
-                {"role": "system", "content": "Return only valid PostgreSQL SQL without fences."},
-                {"role": "user", "content": prompt},
-            ],
-            "temperature": 0.2,
-            "max_tokens": 512,
-        }
-        resp = requests.post(f"{self.groq_base}/chat/completions", json=payload, headers=headers, timeout=120)
+        resp = self.session.post(f"{self.groq_base}/chat/completions", json=self._groq_payload(prompt), timeout=120)
         resp.raise_for_status()
         data = resp.json()
         text = data.get("choices", [{}])[0].get("message", {}).get("content", "")
@@ -80,17 +198,47 @@ class LLM:
 
     def _generate_sql_hf(self, prompt: str) -> str:
         self._log_event("request", {"provider": "hf", "model": self.hf_model, "prompt": prompt})
-        headers = {"Authorization": f"Bearer {self.hf_api_key}"}
-        payload = {
-            "inputs": prompt,
+        resp = self.session.post(
+            f"https://api-inference.huggingface.co/models/{self.hf_model}", json=self._hf_payload(prompt), timeout=180
+        )
+        resp.raise_for_status()
+        text = self._hf_text(resp.json())
+        self._log_event("response", {"provider": "hf", "model": self.hf_model, "response": text})
+        return self._postprocess_sql(text)
+
+    # ----------------- Provider payloads -----------------
+    def _ollama_payload(self, prompt: str) -> dict:
+        return {
+            "model": self.model,
+            "system": self._build_system(),
+            "prompt": prompt,
+            "stream": False,
+            "options": {"num_ctx": OLLAMA_NUM_CTX},
+            # Keep the model resident in memory between clicks
+            "keep_alive": self.ollama_keep_alive,
+        }
+
+    def _groq_payload(self, prompt: str) -> dict:
+        return {
+            "model": self.groq_model,
+            "messages": [
+                {"role": "system", "content": self._build_system()},
+                {"role": "user", "content": prompt},
+            ],
+            "temperature": 0.2,
+            "max_tokens": 512,
+        }
+
+    def _hf_payload(self, prompt: str) -> dict:
+        # The Inference API has no separate system field
+        return {
+            "inputs": f"{self._build_system()}\n\n{prompt}",
             "parameters": {"temperature": 0.2, "max_new_tokens": 512},
             "options": {"wait_for_model": True},
         }
-        resp = requests.post(
-            f"https://api-inference.huggingface.co/models/{self.hf_model}", json=payload, headers=headers, timeout=180
-        )
-        resp.raise_for_status()
-        data = resp.json()
+
+    @staticmethod
+    def _hf_text(data) -> str:
         # Responses can be either a list of dicts or a dict with 'generated_text'
         if isinstance(data, list) and data:
             text = data[0].get("generated_text", "") or data[0].get("summary_text", "") or ""
@@ -99,17 +247,17 @@ class LLM:
         if not text and isinstance(data, list) and data and "generated_text" not in data[0]:
             # Some models return {'generated_text': ...} nested in 'content'
             text = str(data)
-        self._log_event("response", {"provider": "hf", "model": self.hf_model, "response": text})
-        return self._postprocess_sql(text)
+        return text
+
+    @staticmethod
+    def _build_system() -> str:
+        # Kept identical across calls so Ollama can reuse the prefix KV cache
+        return SYSTEM_PROMPT
 
     @staticmethod
-    def _build_prompt(question: str, schema_context: List[str]) -> str:
+    def _build_user(question: str, schema_context: List[str]) -> str:
         context = "\n".join(schema_context)
         return (
-            "You are a helpful assistant that writes syntactically correct PostgreSQL SQL based on the provided database schema.\n"
-            "- Use only tables, columns, and relations that appear in the context.\n"
-            "- Prefer simple SELECTs. If ambiguous, make reasonable assumptions.\n"
-            "- Return ONLY the SQL query. Do not include explanations or markdown fences.\n\n"
             f"Schema Context:\n{context}\n\n"
             f"User Question: {question}\n\n"
             "SQL:"
@@ -119,16 +267,8 @@ class LLM:
     def _postprocess_sql(text: str) -> str:
         if not text:
             return ""
-        t = text.strip()
-        # Remove backtick or triple-backtick fences if present
-        if t.startswith("```"):
-            t = t.strip("`")
-            # Strip 'sql' language tag if present
-            if t.lower().startswith("sql"):
-                t = t[3:]
-        # Remove stray code fences
-        t = t.replace("```sql", "").replace("```", "").strip()
-        return t
+        # Remove code fences (with optional 'sql' language tag) in a single pass
+        return _FENCE_RE.sub("", text).strip()
 
     # ----------------- Logging helpers -----------------
     _logger_initialized = False
@@ -148,6 +288,15 @@ class LLM:
             handler.setFormatter(formatter)
             logger.addHandler(handler)
         LLM._logger_initialized = True
+        if self.provider not in {"groq", "hf"}:
+            self._log_event(
+                "config",
+                {
+                    "provider": "ollama",
+                    "ollama_num_parallel": self.ollama_num_parallel,
+                    "hint": f"run the server with OLLAMA_NUM_PARALLEL={self.ollama_num_parallel} to serve concurrent requests in parallel",
+                },
+            )
 
     def _log_event(self, kind: str, payload: dict) -> None:
         if not self.log_enabled:
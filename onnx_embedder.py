@@ -0,0 +1,77 @@
+import os
+from pathlib import Path
+from typing import List
+
+import numpy as np
+import onnxruntime as ort
+from transformers import AutoTokenizer
+
+
+DEFAULT_ONNX_CACHE_DIR = ".cache/onnx"
+MAX_SEQ_LENGTH = 256  # matches all-MiniLM-L6-v2's sentence-transformers config
+
+
+class OnnxEmbedder:
+    """CPU embedder with the same ``encode`` interface as SentenceTransformer.
+
+    The model is exported to ONNX and dynamically quantized to int8 once (via optimum),
+    then served by ONNX Runtime with mean pooling and L2 normalization done in numpy.
+    """
+
+    def __init__(self, model_name: str, cache_dir: str | None = None) -> None:
+        cache_dir = cache_dir or os.getenv("ONNX_CACHE_DIR", DEFAULT_ONNX_CACHE_DIR)
+        model_dir = Path(cache_dir) / model_name.replace("/", "__")
+        model_path = model_dir / "model_quantized.onnx"
+        if not model_path.exists():
+            self._export(model_name, model_dir)
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = os.cpu_count() or 1
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(str(model_path), sess_options=options, providers=["CPUExecutionProvider"])
+        self._input_names = {i.name for i in self.session.get_inputs()}
+
+    @staticmethod
+    def _export(model_name: str, model_dir: Path) -> None:
+        # optimum is only needed for the one-time export
+        from optimum.onnxruntime import ORTModelForFeatureExtraction, ORTQuantizer
+        from optimum.onnxruntime.configuration import AutoQuantizationConfig
+
+        model = ORTModelForFeatureExtraction.from_pretrained(model_name, export=True)
+        model.save_pretrained(model_dir)
+        AutoTokenizer.from_pretrained(model_name).save_pretrained(model_dir)
+        quantizer = ORTQuantizer.from_pretrained(model)
+        # Dynamic int8 quantization; runs on VNNI int8 GEMM kernels where the CPU has them
+        qconfig = AutoQuantizationConfig.avx512_vnni(is_static=False, per_channel=False)
+        quantizer.quantize(save_dir=model_dir, quantization_config=qconfig)
+
+    def encode(
+        self,
+        sentences: str | List[str],
+        batch_size: int = 32,
+        normalize_embeddings: bool = False,
+        convert_to_numpy: bool = True,
+        show_progress_bar: bool = False,
+        **kwargs,
+    ) -> np.ndarray:
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        batches: List[np.ndarray] = []
+        for start in range(0, len(texts), batch_size):
+            enc = self.tokenizer(
+                texts[start : start + batch_size],
+                padding=True,
+                truncation=True,
+                max_length=MAX_SEQ_LENGTH,
+                return_tensors="np",
+            )
+            feeds = {k: v.astype(np.int64) for k, v in enc.items() if k in self._input_names}
+            hidden = self.session.run(["last_hidden_state"], feeds)[0]
+            # Mean pooling over real (non-padding) tokens
+            mask = enc["attention_mask"][..., None].astype(np.float32)
+            emb = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            if normalize_embeddings:
+                emb = emb / np.clip(np.linalg.norm(emb, axis=1, keepdims=True), 1e-12, None)
+            batches.append(emb.astype(np.float32))
+        embeddings = np.concatenate(batches) if batches else np.empty((0, 0), dtype=np.float32)
+        return embeddings[0] if single else embeddings
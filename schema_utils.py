@@ -25,11 +25,17 @@ def fetch_schema_from_postgres(conn_params: dict | None = None, schema: str = "p
                 SELECT
                     c.table_schema,
                     c.table_name,
-                    c.column_name,
-                    c.data_type,
-                    c.is_nullable,
-                    c.column_default,
-                    pd.description AS column_description
+                    -- json (not jsonb) keeps the key order below; psycopg2 decodes it into Python lists/dicts
+                    json_agg(
+                        json_build_object(
+                            'column_name', c.column_name,
+                            'data_type', c.data_type,
+                            'is_nullable', c.is_nullable,
+                            'column_default', c.column_default,
+                            'description', pd.description
+                        )
+                        ORDER BY c.ordinal_position
+                    ) AS columns
                 FROM information_schema.columns c
                 JOIN information_schema.tables t
                     ON c.table_schema = t.table_schema AND c.table_name = t.table_name
@@ -42,34 +48,15 @@ def fetch_schema_from_postgres(conn_params: dict | None = None, schema: str = "p
                 LEFT JOIN pg_catalog.pg_description pd
                     ON pd.objoid = pc.oid AND pd.objsubid = pa.attnum
                 WHERE t.table_type = 'BASE TABLE' AND c.table_schema = %s
-                ORDER BY c.table_schema, c.table_name, c.ordinal_position
+                GROUP BY c.table_schema, c.table_name
+                ORDER BY c.table_schema, c.table_name
                 """,
                 (schema,),
             )
             rows = cur.fetchall()
 
-    # Group by table
-    grouped: Dict[tuple[str, str], List[Dict[str, Any]]] = {}
-    for (table_schema, table_name, column_name, data_type, is_nullable, column_default, description) in rows:
-        key = (table_schema, table_name)
-        grouped.setdefault(key, [])
-        grouped[key].append(
-            {
-                "column_name": column_name,
-                "data_type": data_type,
-                "is_nullable": is_nullable,
-                "column_default": column_default,
-                "description": description,
-            }
-        )
-
-    result: List[Dict[str, Any]] = []
-    for (table_schema, table_name), columns in grouped.items():
-        result.append({
-            "table_schema": table_schema,
-            "table_name": table_name,
-            "columns": columns,
-        })
-    return result
-
-
+    # One row per table, columns already grouped and ordered by Postgres
+    return [
+        {"table_schema": table_schema, "table_name": table_name, "columns": columns}
+        for table_schema, table_name, columns in rows
+    ]
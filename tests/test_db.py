@@ -0,0 +1,100 @@
+import decimal
+from collections import namedtuple
+from contextlib import contextmanager
+
+import pyarrow as pa
+import pytest
+
+import db
+from db import SQLDatabase
+
+Column = namedtuple("Column", ["name", "type_code"])
+
+INT4, NUMERIC, TEXT, JSONB = 23, 1700, 25, 3802
+
+
+class _FakeCursor:
+    def __init__(self, description=None, rows=()):
+        self.description = description
+        self._rows = list(rows)
+        self.executed = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql):
+        self.executed.append(sql)
+
+    def fetchmany(self, size):
+        batch, self._rows = self._rows[:size], self._rows[size:]
+        return batch
+
+
+class _FakeConnection:
+    def __init__(self, description, rows):
+        self.result = _FakeCursor(description, rows)
+        self.guard = _FakeCursor()
+
+    def cursor(self, name=None):
+        return self.result if name else self.guard
+
+
+def _run(monkeypatch, description, rows, batch_rows=2):
+    monkeypatch.setattr(db, "READ_CHUNK_ROWS", batch_rows)
+    conn = _FakeConnection([Column(*d) for d in description], rows)
+
+    @contextmanager
+    def connect(self):
+        yield conn
+
+    monkeypatch.setattr(SQLDatabase, "_connect", connect)
+    return SQLDatabase(conn_params={}).run_query("SELECT 1;"), conn
+
+
+def test_run_query_pins_the_transaction_read_only(monkeypatch):
+    _, conn = _run(monkeypatch, [("n", INT4)], [(1,)])
+    assert conn.guard.executed == ["SET TRANSACTION READ ONLY;"]
+    assert conn.result.executed == ["SELECT 1"]
+
+
+def test_run_query_rejects_multiple_statements():
+    with pytest.raises(ValueError):
+        SQLDatabase(conn_params={}).run_query("SELECT 1; SET default_transaction_read_only = off")
+
+
+def test_batches_with_different_inferred_types_fall_back_to_text(monkeypatch):
+    df, _ = _run(monkeypatch, [("v", TEXT)], [("a",), ("b",), (3,), (None,)])
+    assert df["v"].dtype.pyarrow_dtype == pa.string()
+    assert df["v"].tolist()[:3] == ["a", "b", "3"]
+    assert df["v"].isna().tolist() == [False, False, False, True]
+
+
+def test_decimal_and_null_batches_are_widened(monkeypatch):
+    rows = [(None,), (None,), (decimal.Decimal("1.5"),), (None,), (decimal.Decimal("123"),)]
+    df, _ = _run(monkeypatch, [("amount", NUMERIC)], rows)
+    assert pa.types.is_decimal(df["amount"].dtype.pyarrow_dtype)
+    assert df["amount"].tolist()[2] == decimal.Decimal("1.5")
+    assert df["amount"].tolist()[4] == decimal.Decimal("123")
+
+
+def test_json_columns_stay_as_document_text(monkeypatch):
+    df, _ = _run(monkeypatch, [("doc", JSONB)], [({"a": 1},), ({"b": "x"},), (None,)])
+    assert df["doc"].tolist()[:2] == ['{"a": 1}', '{"b": "x"}']
+    assert df["doc"].isna().tolist() == [False, False, True]
+
+
+def test_duplicate_column_names_keep_their_own_types(monkeypatch):
+    rows = [(1, "x"), (2, "y"), (3, "z")]
+    df, _ = _run(monkeypatch, [("id", INT4), ("id", TEXT)], rows)
+    assert list(df.columns) == ["id", "id"]
+    assert pa.types.is_integer(df.iloc[:, 0].dtype.pyarrow_dtype)
+    assert df.iloc[:, 1].tolist() == ["x", "y", "z"]
+
+
+def test_empty_result_keeps_column_names(monkeypatch):
+    df, _ = _run(monkeypatch, [("id", INT4), ("name", TEXT)], [])
+    assert list(df.columns) == ["id", "name"]
+    assert len(df) == 0
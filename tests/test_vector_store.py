@@ -0,0 +1,40 @@
+import json
+import struct
+
+import numpy as np
+
+from vector_store import VectorStore
+
+
+def _read_field(buf) -> bytes:
+    (length,) = struct.unpack("!i", buf.read(4))
+    return buf.read(length)
+
+
+def test_copy_binary_buffer_round_trips_one_row():
+    metadata = {"table": "orders", "column": "amount"}
+    embedding = np.array([0.5, -1.25, 2.0], dtype=np.float32)
+
+    buf = VectorStore._copy_binary_buffer([("public.orders", "orders(amount numeric)", metadata)], np.stack([embedding]))
+
+    # Header: signature, flags, header-extension length
+    assert buf.read(11) == b"PGCOPY\n\xff\r\n\x00"
+    assert struct.unpack("!ii", buf.read(8)) == (0, 0)
+
+    assert struct.unpack("!h", buf.read(2)) == (4,)
+    assert _read_field(buf).decode("utf-8") == "public.orders"
+    assert _read_field(buf).decode("utf-8") == "orders(amount numeric)"
+
+    meta_b = _read_field(buf)
+    assert meta_b[:1] == b"\x01"  # jsonb version byte
+    assert json.loads(meta_b[1:].decode("utf-8")) == metadata
+
+    vec_b = _read_field(buf)
+    dim, unused = struct.unpack("!HH", vec_b[:4])
+    assert (dim, unused) == (3, 0)
+    assert len(vec_b) == 4 + 2 * dim
+    np.testing.assert_array_equal(np.frombuffer(vec_b[4:], dtype=">f2"), embedding.astype(np.float16))
+
+    # Trailer, then nothing else
+    assert struct.unpack("!h", buf.read(2)) == (-1,)
+    assert buf.read() == b""
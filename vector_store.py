@@ -1,32 +1,116 @@
+import functools
+import hashlib
+import io
 import json
-from typing import List, Optional, Tuple
+import os
+import sqlite3
+import struct
+import threading
+from pathlib import Path
+from typing import TYPE_CHECKING, List, Optional, Tuple
 
+import numpy as np
 import psycopg2
-from psycopg2.extras import execute_values
-from sentence_transformers import SentenceTransformer
 
+import db
 from config import DB_VECTOR
+from db import BlockingConnectionPool
+
+if TYPE_CHECKING:
+    from sentence_transformers import SentenceTransformer
+
+    from onnx_embedder import OnnxEmbedder
 
 
 EMBEDDING_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+# EMBED_BACKEND: "torch" (SentenceTransformer) or "onnx" (int8-quantized ONNX Runtime, CPU)
+DEFAULT_EMBED_BACKEND = "torch"
+DEFAULT_EMBEDDING_CACHE_PATH = ".cache/embeddings.sqlite3"
+COPY_BATCH_ROWS = 10_000
+HNSW_EF_SEARCH = 40
+
+# PostgreSQL binary COPY framing: signature, flags, header-extension length / trailer
+_COPY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack("!ii", 0, 0)
+_COPY_TRAILER = struct.pack("!h", -1)
+
+# Loaded models by name, so the query-embedding cache can be keyed on a hashable id
+_MODELS: dict[str, "SentenceTransformer | OnnxEmbedder"] = {}
+
+
+class _VectorConnectionPool(BlockingConnectionPool):
+    """Shared blocking pool whose connections come ready for pgvector."""
+
+    def _connect(self, key=None):
+        from pgvector.psycopg2 import register_vector
+
+        conn = super()._connect(key)
+        # register_vector looks up the vector type oid, so the extension has to exist first
+        with conn.cursor() as cur:
+            cur.execute("CREATE EXTENSION IF NOT EXISTS vector;")
+            cur.execute("SET hnsw.ef_search = %s;", (HNSW_EF_SEARCH,))
+        register_vector(conn)
+        conn.commit()
+        return conn
+
+
+def get_pool(conn_params: dict | None = None) -> _VectorConnectionPool:
+    """Return the shared pgvector pool for these params (DB_VECTOR by default)."""
+    return db.get_pool(conn_params or DB_VECTOR, _VectorConnectionPool)
+
+
+def _embed_backend() -> str:
+    return os.getenv("EMBED_BACKEND", DEFAULT_EMBED_BACKEND).lower()
+
+
+def load_embedding_model(embedding_model_name: str = EMBEDDING_MODEL_NAME) -> "SentenceTransformer | OnnxEmbedder":
+    if _embed_backend() == "onnx":
+        from onnx_embedder import OnnxEmbedder
+
+        return OnnxEmbedder(embedding_model_name)
+    # torch and sentence-transformers are only needed once a model is loaded
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    return SentenceTransformer(embedding_model_name, device=device)
+
+
+@functools.lru_cache(maxsize=256)
+def _encode_query(model_id: str, query: str) -> bytes:
+    emb = _MODELS[model_id].encode([query], normalize_embeddings=True, convert_to_numpy=True, show_progress_bar=False)
+    return emb[0].astype(np.float32).tobytes()
 
 
 class VectorStore:
-    def __init__(self, conn_params: dict | None = None, embedding_model_name: str = EMBEDDING_MODEL_NAME) -> None:
+    def __init__(
+        self,
+        conn_params: dict | None = None,
+        embedding_model_name: str = EMBEDDING_MODEL_NAME,
+        cache_path: str | None = None,
+        model: "SentenceTransformer | OnnxEmbedder | None" = None,
+    ) -> None:
         self.conn_params = conn_params or DB_VECTOR
-        self.model = SentenceTransformer(embedding_model_name)
+        self.embedding_model_name = embedding_model_name
+        # Quantized ONNX vectors differ slightly from torch ones, so they are cached separately
+        self.model_id = embedding_model_name if _embed_backend() != "onnx" else f"{embedding_model_name}@onnx-int8"
+        # Callers may pass a model loaded elsewhere (e.g. concurrently at app startup)
+        self.model = model if model is not None else load_embedding_model(embedding_model_name)
+        _MODELS[self.model_id] = self.model
+        self._cache_lock = threading.Lock()
+        self._cache = self._open_cache(cache_path or os.getenv("EMBEDDING_CACHE_PATH", DEFAULT_EMBEDDING_CACHE_PATH))
+        self._fingerprint: str | None = None
 
     def _connect(self):
-        return psycopg2.connect(
-            host=self.conn_params["host"],
-            port=self.conn_params["port"],
-            dbname=self.conn_params["dbname"],
-            user=self.conn_params["user"],
-            password=self.conn_params["password"],
-        )
+        return get_pool(self.conn_params).connection()
+
+    # DDL only needs to run once per process; later calls are no-ops. Every DB-facing method calls
+    # setup() first, so the schema is created lazily on first use (and retried if the DB was down)
+    _setup_complete = False
 
     def setup(self) -> None:
         """Create extension, collection table and indexes if not exists."""
+        if type(self)._setup_complete:
+            return
         with self._connect() as conn, conn.cursor() as cur:
             cur.execute("CREATE EXTENSION IF NOT EXISTS vector;")
             cur.execute(
@@ -36,95 +120,237 @@ class VectorStore:
                   source TEXT NOT NULL,               -- file/table origin
                   chunk TEXT NOT NULL,                -- natural language chunk
                   metadata JSONB NOT NULL DEFAULT '{}',
-                  embedding VECTOR(384)              -- dimension must match model
+                  embedding HALFVEC(384),            -- fp16; dimension must match model
+                  chunk_hash BYTEA GENERATED ALWAYS AS (decode(md5(chunk), 'hex')) STORED
                 );
                 """
             )
-            # pgvector requires specifying the operator class, e.g., vector_cosine_ops
+            # Content-hash dedup: tables from earlier versions lack chunk_hash and may hold duplicates
+            cur.execute(
+                "ALTER TABLE schema_chunks ADD COLUMN IF NOT EXISTS chunk_hash BYTEA "
+                "GENERATED ALWAYS AS (decode(md5(chunk), 'hex')) STORED;"
+            )
+            cur.execute("SELECT 1 FROM pg_indexes WHERE indexname = 'uq_schema_chunks_source_hash';")
+            if not cur.fetchone():
+                cur.execute(
+                    """
+                    DELETE FROM schema_chunks a USING schema_chunks b
+                    WHERE a.source = b.source AND a.chunk_hash = b.chunk_hash AND a.id > b.id;
+                    """
+                )
+                cur.execute("CREATE UNIQUE INDEX uq_schema_chunks_source_hash ON schema_chunks (source, chunk_hash);")
+            # Replace the IVFFlat index from earlier versions; HNSW needs no lists tuning or training data
+            cur.execute(
+                "SELECT 1 FROM pg_indexes WHERE indexname = 'idx_schema_chunks_embedding' AND indexdef ILIKE '%ivfflat%';"
+            )
+            if cur.fetchone():
+                cur.execute("DROP INDEX idx_schema_chunks_embedding;")
+            # Tables created by earlier versions store fp32 vector(384); convert them in place
+            cur.execute(
+                """
+                SELECT format_type(atttypid, atttypmod) FROM pg_attribute
+                WHERE attrelid = 'schema_chunks'::regclass AND attname = 'embedding';
+                """
+            )
+            if cur.fetchone()[0] != "halfvec(384)":
+                cur.execute("DROP INDEX IF EXISTS idx_schema_chunks_embedding;")
+                cur.execute("ALTER TABLE schema_chunks ALTER COLUMN embedding TYPE halfvec(384) USING embedding::halfvec(384);")
+            # pgvector requires specifying the operator class, e.g., halfvec_cosine_ops
+            cur.execute("SAVEPOINT embedding_index;")
             try:
                 cur.execute(
-                    "CREATE INDEX IF NOT EXISTS idx_schema_chunks_embedding ON schema_chunks USING ivfflat (embedding vector_cosine_ops) WITH (lists = 100);"
+                    "CREATE INDEX IF NOT EXISTS idx_schema_chunks_embedding ON schema_chunks USING hnsw (embedding halfvec_cosine_ops) WITH (m = 16, ef_construction = 64);"
                 )
-            except Exception:
-                # Fallback: create a plain index-less table (search still works, just slower)
-                pass
+            except psycopg2.Error:
+                # Fallback: keep the table index-less (search still works, just slower)
+                cur.execute("ROLLBACK TO SAVEPOINT embedding_index;")
             cur.execute("CREATE INDEX IF NOT EXISTS idx_schema_chunks_source ON schema_chunks (source);")
             conn.commit()
+        type(self)._setup_complete = True
 
     def clear(self) -> None:
+        self.setup()
         with self._connect() as conn, conn.cursor() as cur:
             cur.execute("TRUNCATE schema_chunks;")
             conn.commit()
+        self._fingerprint = None
 
     def upsert_chunks(self, rows: List[Tuple[str, str, dict]]) -> int:
-        """Insert chunks with embeddings. rows: [(source, chunk, metadata_json), ...]"""
+        """Insert chunks with embeddings, skipping ones already indexed. rows: [(source, chunk, metadata_json), ...]
+
+        Returns the number of newly inserted chunks.
+        """
+        if not rows:
+            return 0
+        self.setup()
+        # Drop chunks the table already holds before paying for embeddings
+        existing = self._existing_hashes(sorted({r[0] for r in rows}))
+        rows = [r for r in rows if (r[0], hashlib.md5(r[1].encode("utf-8")).digest()) not in existing]
         if not rows:
             return 0
         texts = [r[1] for r in rows]
-        embeddings = self.model.encode(texts, normalize_embeddings=True).tolist()
-        values = [(r[0], r[1], json.dumps(r[2]), self._to_pgvector(e)) for r, e in zip(rows, embeddings)]
+        embeddings = self._encode_cached(texts)
         with self._connect() as conn, conn.cursor() as cur:
-            execute_values(
-                cur,
-                "INSERT INTO schema_chunks (source, chunk, metadata, embedding) VALUES %s",
-                values,
-                template="(%s, %s, %s, %s)",
+            # COPY cannot skip conflicts, so load into a staging table and merge from there
+            cur.execute(
+                """
+                CREATE TEMP TABLE schema_chunks_stage (
+                  source TEXT, chunk TEXT, metadata JSONB, embedding HALFVEC(384)
+                ) ON COMMIT DROP;
+                """
             )
+            for start in range(0, len(rows), COPY_BATCH_ROWS):
+                buf = self._copy_binary_buffer(
+                    rows[start : start + COPY_BATCH_ROWS], embeddings[start : start + COPY_BATCH_ROWS]
+                )
+                cur.copy_expert(
+                    "COPY schema_chunks_stage (source, chunk, metadata, embedding) FROM STDIN WITH (FORMAT BINARY)",
+                    buf,
+                )
+            cur.execute(
+                """
+                INSERT INTO schema_chunks (source, chunk, metadata, embedding)
+                SELECT source, chunk, metadata, embedding FROM schema_chunks_stage
+                ON CONFLICT (source, chunk_hash) DO NOTHING;
+                """
+            )
+            inserted = cur.rowcount
             conn.commit()
-        return len(values)
+        self._fingerprint = None
+        return inserted
+
+    def _existing_hashes(self, sources: List[str]) -> set[tuple[str, bytes]]:
+        with self._connect() as conn, conn.cursor() as cur:
+            cur.execute("SELECT source, chunk_hash FROM schema_chunks WHERE source = ANY(%s);", (sources,))
+            return {(source, bytes(chunk_hash)) for source, chunk_hash in cur.fetchall()}
+
+    def fingerprint(self) -> str:
+        """md5 over every indexed (source, chunk); changes whenever the indexed schema does."""
+        if self._fingerprint is None:
+            self.setup()
+            with self._connect() as conn, conn.cursor() as cur:
+                cur.execute(
+                    "SELECT md5(coalesce(string_agg(source || chunk, '' ORDER BY source, chunk), '')) FROM schema_chunks;"
+                )
+                self._fingerprint = cur.fetchone()[0]
+        return self._fingerprint
 
     def search(self, query: str, k: int = 6) -> List[dict]:
-        query_emb = self._to_pgvector(self.model.encode([query], normalize_embeddings=True)[0].tolist())
+        self.setup()
+        normalized = " ".join(query.split())
+        query_emb = np.frombuffer(_encode_query(self.model_id, normalized), dtype=np.float32)
         with self._connect() as conn, conn.cursor() as cur:
+            # The pgvector psycopg2 adapter renders the ndarray as a '[...]' text literal; only
+            # the COPY ingest path is binary. One 384-float literal per query is not worth a custom encoder.
             cur.execute(
                 """
-                SELECT source, chunk, metadata, 1 - (embedding <=> %s::vector) AS score
+                SELECT source, chunk, metadata, embedding <=> %s::halfvec(384) AS dist
                 FROM schema_chunks
-                ORDER BY embedding <-> %s::vector
+                ORDER BY dist
                 LIMIT %s
                 """,
-                (query_emb, query_emb, k),
+                (query_emb, k),
             )
             rows = cur.fetchall()
         return [
-            {"source": r[0], "chunk": r[1], "metadata": r[2], "score": float(r[3])}
+            {"source": r[0], "chunk": r[1], "metadata": r[2], "score": 1.0 - float(r[3])}
             for r in rows
         ]
 
     @staticmethod
-    def _to_pgvector(embedding: List[float]) -> str:
-        # Serialize to pgvector literal, e.g. '[0.1, 0.2, ...]'
-        return "[" + ", ".join(f"{x:.8f}" for x in embedding) + "]"
+    def _copy_binary_buffer(rows: List[Tuple[str, str, dict]], embeddings: np.ndarray) -> io.BytesIO:
+        """Encode rows in COPY BINARY format; vectors go out as raw big-endian float16, no text formatting."""
+        buf = io.BytesIO()
+        buf.write(_COPY_HEADER)
+        for (source, chunk, metadata), emb in zip(rows, embeddings):
+            source_b = source.encode("utf-8")
+            chunk_b = chunk.encode("utf-8")
+            # jsonb binary format is a version byte followed by the JSON text
+            meta_b = b"\x01" + json.dumps(metadata).encode("utf-8")
+            # pgvector halfvec binary format: int16 dim, int16 unused, float2[dim]
+            vec_b = struct.pack("!HH", emb.shape[0], 0) + emb.astype(">f2").tobytes()
+            buf.write(struct.pack("!h", 4))
+            for field in (source_b, chunk_b, meta_b, vec_b):
+                buf.write(struct.pack("!i", len(field)))
+                buf.write(field)
+        buf.write(_COPY_TRAILER)
+        buf.seek(0)
+        return buf
+
+    # ----------------- Embedding cache helpers -----------------
+    @staticmethod
+    def _open_cache(cache_path: str) -> sqlite3.Connection:
+        path = Path(cache_path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Streamlit reruns on different threads; access is serialized by _cache_lock
+        cache = sqlite3.connect(path, check_same_thread=False)
+        cache.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (model TEXT NOT NULL, hash TEXT NOT NULL, "
+            "vector BLOB NOT NULL, PRIMARY KEY (model, hash))"
+        )
+        cache.commit()
+        return cache
+
+    def _encode_cached(self, texts: List[str]) -> np.ndarray:
+        """Embed texts, only running the model on chunks not already in the sidecar cache."""
+        hashes = [hashlib.sha256(t.encode("utf-8")).hexdigest() for t in texts]
+        cached: dict[str, bytes] = {}
+        with self._cache_lock:
+            unique = list(set(hashes))
+            # Stay well below SQLite's bound-parameter limit
+            for start in range(0, len(unique), 500):
+                batch = unique[start : start + 500]
+                placeholders = ", ".join("?" for _ in batch)
+                cached.update(
+                    self._cache.execute(
+                        f"SELECT hash, vector FROM embeddings WHERE model = ? AND hash IN ({placeholders})",
+                        [self.model_id, *batch],
+                    ).fetchall()
+                )
+
+        missing_idx = [i for i, h in enumerate(hashes) if h not in cached]
+        if missing_idx:
+            fresh = self.model.encode(
+                [texts[i] for i in missing_idx],
+                batch_size=64,
+                normalize_embeddings=True,
+                convert_to_numpy=True,
+                show_progress_bar=False,
+            ).astype(np.float32)
+            new_entries = {hashes[i]: vec.tobytes() for i, vec in zip(missing_idx, fresh)}
+            with self._cache_lock:
+                self._cache.executemany(
+                    "INSERT OR REPLACE INTO embeddings (model, hash, vector) VALUES (?, ?, ?)",
+                    [(self.model_id, h, v) for h, v in new_entries.items()],
+                )
+                self._cache.commit()
+            cached.update(new_entries)
+
+        # Reassemble in the original row order
+        return np.stack([np.frombuffer(cached[h], dtype=np.float32) for h in hashes])
 
 
 def flatten_schema_json(schema_json: list[dict]) -> List[Tuple[str, str, dict]]:
     """Convert a schema JSON (like DB_Schema.json) into text chunks for embedding."""
     rows: List[Tuple[str, str, dict]] = []
+    append, extend = rows.append, rows.extend
     for table in schema_json:
         schema = table.get("table_schema", "public")
         table_name = table.get("table_name")
         source = f"{schema}.{table_name}"
+        columns = table.get("columns", [])
+        col_names = [c["column_name"] for c in columns]
         # table summary chunk
-        summary = f"Table {source}. Columns: " + ", ".join(c["column_name"] for c in table.get("columns", []))
-        rows.append((source, summary, {"kind": "table", "schema": schema, "table": table_name}))
-        for col in table.get("columns", []):
-            col_txt = (
-                f"Column {schema}.{table_name}.{col['column_name']} type {col['data_type']} "
+        summary = f"Table {source}. Columns: " + ", ".join(col_names)
+        append((source, summary, {"kind": "table", "schema": schema, "table": table_name}))
+        extend(
+            (
+                source,
+                f"Column {source}.{name} type {col['data_type']} "
                 f"nullable={col.get('is_nullable')} default={col.get('column_default')} "
-                f"desc={col.get('description')}"
-            )
-            rows.append(
-                (
-                    source,
-                    col_txt,
-                    {
-                        "kind": "column",
-                        "schema": schema,
-                        "table": table_name,
-                        "column": col.get("column_name"),
-                    },
-                )
+                f"desc={col.get('description')}",
+                {"kind": "column", "schema": schema, "table": table_name, "column": name},
             )
+            for name, col in zip(col_names, columns)
+        )
     return rows
-
-